@@ -18,16 +18,47 @@ from matplotlib.backends.backend_tkagg import (
 # Implement the default Matplotlib key bindings.
 from matplotlib.backend_bases import key_press_handler
 from matplotlib.figure import Figure
+import sys
+import time
 import plots
+import profiling
+import timing
+from timing import TIMER
+
+# Slider changes are gathered and drawn at most once per frame
+FRAME_MS = 16
+
+# Wrapped when profiling is on: the controls, the frame update and the redraw
+# (pollWorker itself fires every frame and is left alone)
+PROFILED = ("upNumEle", "upDPhi", "upD", "upL", "upCut", "up3D", "insDip",
+            "updateControls", "runFrame", "redraw")
 
 class Application(tk.Frame):
-    def __init__(self, master=None):
+    def __init__(self, master=None, profiler=None, timingPath=None):
         super().__init__(master)
         self.master = master
         master.title("GUI Based Antenna Simulation")
         self.pack()
+        self.pending = {}
+        self.frameJob = None
+        # Without a profiler nothing is wrapped, the callbacks are the plain methods
+        self.profiler = profiler
+        if(profiler is not None):
+            profiler.instrument(self, PROFILED)
         self.create_frames()
+        if(profiler is not None):
+            profiler.instrumentJobs(self.plots)
         self.create_widgets()
+        # With a timing path the stage timings are shown on the figure and
+        # Ctrl+T writes them out, they are also written on exit
+        self.timingPath = timingPath
+        if(timingPath is not None):
+            self.plots.setTimingOverlay(True)
+            self.master.bind("<Control-t>", self.dumpTimings)
+            self.canvas.draw()
+        # Pattern math runs on a worker thread, results are picked up here
+        self.plots.startWorker()
+        self.after(FRAME_MS, self.pollWorker)
 
 
     def create_frames(self):
@@ -37,6 +68,7 @@ class Application(tk.Frame):
         self.w_frame.pack(side = 'right')
         self.plots = plots.Plots(figsize=(11,9), dpi=75)
         self.canvas = FigureCanvasTkAgg(self.plots, master=self.p_frame)
+        self.plots.attachCanvas(self.canvas)
         self.canvas.draw()
         self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
 
@@ -118,6 +150,25 @@ class Application(tk.Frame):
         self.perp = tk.Radiobutton(self.w_frame, text="Perpendicular Array", variable=self.insDipVar, value=3, command=self.insDip)
         ### /INSERT DIPOLE CHECKBOX ###
 
+        ### CUT PLANE SLIDER ###
+        self.cutVar = tk.IntVar()
+        self.cutVar.set(0)
+        self.cutBox = tk.Checkbutton(self.w_frame, text="Show Cut Plane", variable=self.cutVar, command=self.upCut)
+        self.cutBox.grid(row=7,
+                         columnspan=3)
+        self.cut_sc = tk.Scale(self.w_frame,
+                              from_=-180,
+                              to=180,
+                              resolution=5,
+                              length=300,
+                              orient='horizontal',
+                              tickinterval=60,
+                              command=self.upCut,
+                              label="Cut Plane \u03c6 [deg]")
+        self.cut_sc.grid(row=8,
+                         columnspan=3)
+        ### /CUT PLANE SLIDER ###
+
         ### Toggle 3D Button ###
         self.button3D = tk.Button(self.w_frame,
                                   text="Show 3D Plot", fg="green",
@@ -131,29 +182,59 @@ class Application(tk.Frame):
                               command=self.master.destroy)
         self.quit.pack(side="bottom")
 
+    def redraw(self):
+        # Slider updates only blit the pattern lines, anything that changes
+        # the static parts of the figure gets a full draw
+        start = time.perf_counter()
+        if(self.plots.blit2D()):
+            TIMER.record("blit", time.perf_counter() - start)
+        else:
+            with TIMER.stage("draw"):
+                self.canvas.draw()
+
+    def dumpTimings(self, event=None):
+        self.plots.dumpTimings(self.timingPath)
+
+    def schedule(self, setter, value):
+        # Sliders fire for every value they pass during a drag. Only the latest
+        # value per Plots setter is kept, and everything pending is applied
+        # with a single update and draw on the next frame.
+        self.pending[setter] = value
+        if(self.frameJob is None):
+            self.frameJob = self.after(FRAME_MS, self.runFrame)
+
+    def runFrame(self):
+        # Only submits the update, pollWorker draws it once it is computed
+        self.frameJob = None
+        pending, self.pending = self.pending, {}
+        self.plots.applyChanges(pending)
+
+    def pollWorker(self):
+        self.after(FRAME_MS, self.pollWorker)
+        if(self.plots.pollWorker()):
+            self.redraw()
+
     def upNumEle(self, slidevalue):
-        self.plots.setNumEle(slidevalue)
-        self.canvas.draw()
+        self.schedule("setNumEle", slidevalue)
 
     def upDPhi(self, slidevalue):
-        self.plots.setDPhi(slidevalue)
-        self.canvas.draw()
+        self.schedule("setDPhi", slidevalue)
 
     def upD(self, slidevalue):
-        if (float(slidevalue) == 0):
-            newVal = 0.0001
-        else:
-            newVal = slidevalue
-        self.plots.setD(newVal)
-        self.canvas.draw()
+        self.schedule("setD", slidevalue)
 
     def upL(self, slidevalue):
         if (float(slidevalue) == 0):
-            newVal = 0.0001
+            newVal = plots.MIN_LENGTH
         else:
             newVal = slidevalue
-        self.plots.setL(newVal)
-        self.canvas.draw()
+        self.schedule("setL", newVal)
+
+    def upCut(self, slidevalue=None):
+        if(self.cutVar.get()):
+            self.schedule("setCut", self.cut_sc.get())
+        else:
+            self.schedule("setCut", None)
 
     def up3D(self):
         if (self.plots.toggle3D() == True):
@@ -175,7 +256,6 @@ class Application(tk.Frame):
             self.l_sc.grid(row=6,
                             columnspan=3)
             self.plots.setArrType("PerpArray")
-        self.canvas.draw()
 
     def updateControls(self, value):
         simType = self.simType.get()
@@ -204,7 +284,6 @@ class Application(tk.Frame):
             self.perp.grid(row=5,
                             column=2)
         self.plots.setSimType(simType)
-        self.canvas.draw()
 
 
     def toggleWidgets(self,onOff='on'):
@@ -215,6 +294,8 @@ class Application(tk.Frame):
             self.coLin.configure(state='disabled')
             self.perp.configure(state='disabled')
             self.l_sc.configure(state='disabled')
+            self.cutBox.configure(state='disabled')
+            self.cut_sc.configure(state='disabled')
             self.simTypeMenu.configure(state='disabled')
         else:
             self.dp_sc.configure(state='normal')
@@ -223,6 +304,8 @@ class Application(tk.Frame):
             self.coLin.configure(state='normal')
             self.perp.configure(state='normal')
             self.l_sc.configure(state='normal')
+            self.cutBox.configure(state='normal')
+            self.cut_sc.configure(state='normal')
             self.simTypeMenu.configure(state='normal')
 
 
@@ -231,6 +314,16 @@ class Application(tk.Frame):
 ### Constuct Figures ###
 
 
+# --profile DIR or ANTENNA_PROFILE=DIR writes per-interaction profiles to DIR
+profileDir = profiling.profileDirectory(sys.argv[1:])
+profiler = profiling.InteractionProfiler(profileDir) if profileDir else None
+# --timing PATH or ANTENNA_TIMING=PATH shows stage timings and dumps them to PATH
+timingPath = timing.timingPath(sys.argv[1:])
+
 root = tk.Tk()
-app = Application(master=root)
+app = Application(master=root, profiler=profiler, timingPath=timingPath)
 app.mainloop()
+if(profiler is not None):
+    profiler.close()
+if(timingPath is not None):
+    app.dumpTimings()
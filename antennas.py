@@ -2,94 +2,877 @@
 """
 Antenna Module for Antenna Simulator
 
+The pattern engine at the top of this module is plain NumPy: it takes the
+antenna parameters and the angle arrays explicitly, so patterns can be
+computed without building a matplotlib Figure. AntennaProfile is the thin
+adapter used by the Plots figure.
+
 Author: Jordan Baxter
 """
 
+import threading
+from collections import OrderedDict, namedtuple
+
 import numpy as np
 from numpy import pi, cos, sin, tan
-from scipy import integrate
+from scipy import special, spatial
+
+from timing import TIMER
+
+### PATTERN ENGINE ###
+
+class AntennaParams(namedtuple('AntennaParams',
+                               ['simType', 'arrType', 'len', 'd', 'd_phi', 'numEle'])):
+    __slots__ = ()
+
+    @classmethod
+    def fromPlots(cls, Plots):
+        return cls(Plots.simType, Plots.arrType, Plots.len, Plots.d, Plots.d_phi, Plots.numEle)
+
+Pattern2D = namedtuple('Pattern2D', ['eRad', 'hRad', 'direc', 'DtPat'])
+
+### ANGLE GRIDS ###
+
+def readOnly(arr):
+    arr.setflags(write=False)
+    return arr
+
+def axisInverse(sinTheta):
+    # 1 / |sin(theta)| for the dipole factor, 0 on the dipole axis where the
+    # factor's numerator vanishes too, so the axial null is 0 instead of 0/0
+    with np.errstate(divide='ignore'):
+        inv = 1 / np.abs(sinTheta)
+    inv[np.isinf(inv)] = 0
+    return readOnly(inv)
+
+class AngleGrid():
+    # Trig tables and scratch buffers for one sorted theta vector, built once
+    # per resolution so pattern updates do not re-evaluate cos/sin
+    def __init__(self, theta):
+        self.theta = theta
+        self.cos = readOnly(cos(theta))
+        self.sin = readOnly(sin(theta))
+        self.invSin = axisInverse(self.sin)
+        self.invCos = axisInverse(self.cos)
+        self.ones = readOnly(np.ones(theta.shape))
+        self.work = np.empty(theta.shape)
+        self.index = np.empty(theta.shape, dtype=np.intp)
+
+    @classmethod
+    def of(cls, theta):
+        return theta if isinstance(theta, cls) else cls(theta)
+
+class SphereGrid():
+    # Same as AngleGrid for the 3D plot mesh, which is spherical about `axis`:
+    # "z" (the dipole axis, theta) or "y" (the array axis, gamma). A cosine
+    # measured from the mesh axis only depends on the polar angle, so it is
+    # kept as a (1, polar) row and the factors on it are evaluated once per
+    # polar angle and broadcast over the azimuth. The other cosine is a full
+    # (azimuth, polar) mesh. ux/uy/uz are the unit directions for plotting.
+    def __init__(self, polar, azimuth, axis="z"):
+        self.polar = polar
+        self.azimuth = azimuth
+        self.axis = axis
+        self.shape = (len(azimuth), len(polar))
+        cosPolar = cos(polar)[np.newaxis, :]
+        sinPolar = sin(polar)[np.newaxis, :]
+        across = sinPolar * cos(azimuth)[:, np.newaxis]
+        along = sinPolar * sin(azimuth)[:, np.newaxis]
+        if(axis == "z"):
+            self.cosTheta, self.cosGamma = cosPolar, along
+            self.ux, self.uy, self.uz = across, along, np.broadcast_to(cosPolar, self.shape)
+        elif(axis == "y"):
+            self.cosTheta, self.cosGamma = along, cosPolar
+            self.ux, self.uy, self.uz = across, np.broadcast_to(cosPolar, self.shape), along
+        else:
+            raise ValueError("Unknown sphere axis: %s" % axis)
+        for table in (self.cosTheta, self.cosGamma, self.ux, self.uy, self.uz):
+            readOnly(table)
+        self.invSinTheta = axisInverse(np.sqrt(1 - self.cosTheta**2))
+        self.invSinGamma = axisInverse(np.sqrt(1 - self.cosGamma**2))
+        # Spherical angles about z whatever the mesh axis is
+        self.THETA = readOnly(np.arccos(np.clip(self.uz, -1, 1)))
+        self.PHI = readOnly(np.arctan2(self.uy, self.ux))
+        # The array factor is always evaluated on cosGamma
+        self.work = np.empty(self.cosGamma.shape)
+        self.work2 = np.empty(self.cosGamma.shape)
+        self.index = np.empty(self.cosGamma.shape, dtype=np.intp)
+
+class DirectionGrid():
+    # SphereGrid tables for arbitrary unit directions, flat (points,) arrays
+    # so pattern3D takes them, e.g. the directions along a pattern cut
+    def __init__(self, ux, uy, uz):
+        self.shape = np.shape(ux)
+        self.ux = readOnly(ux)
+        self.uy = readOnly(uy)
+        self.uz = readOnly(uz)
+        self.cosTheta, self.cosGamma = self.uz, self.uy
+        self.invSinTheta = axisInverse(np.sqrt(1 - np.minimum(self.cosTheta**2, 1)))
+        self.invSinGamma = axisInverse(np.sqrt(1 - np.minimum(self.cosGamma**2, 1)))
+        self.THETA = readOnly(np.arccos(np.clip(uz, -1, 1)))
+        self.PHI = readOnly(np.arctan2(self.uy, self.ux))
+        self.work = np.empty(self.shape)
+        self.work2 = np.empty(self.shape)
+        self.index = np.empty(self.shape, dtype=np.intp)
+
+class EqualAreaGrid(DirectionGrid):
+    # Fibonacci lattice: points spiral from pole to pole in equal steps of
+    # cos(theta) and golden angle steps of phi, so every point stands for the
+    # same 4 pi / points of solid angle instead of crowding at the poles.
+    # Carries the convex hull triangles for rendering.
+    def __init__(self, points, triangulate=False):
+        i = np.arange(points) + 0.5
+        uz = 1 - 2 * i / points
+        azimuth = pi * (3 - np.sqrt(5)) * i
+        sinTheta = np.sqrt(1 - uz**2)
+        super().__init__(sinTheta * cos(azimuth), sinTheta * sin(azimuth), uz)
+        self.weight = 4 * pi / points
+        self.triangles = None
+        if(triangulate):
+            hull = spatial.ConvexHull(np.column_stack((self.ux, self.uy, self.uz)))
+            self.triangles = readOnly(hull.simplices)
+
+def equalAreaPoints(size):
+    # Lattice size with the solid angle per point of a size x size theta/phi
+    # mesh at its equator, where that mesh is coarsest
+    return int(2 * size**2 / pi)
+
+def sphereAxis(params):
+    # Mesh axis that makes the whole pattern depend on the polar angle only
+    # when possible: the array axis for NoDip and ColArray, else the dipole axis
+    if(params.simType == "Antenna Array" and params.arrType in ("NoDip", "ColArray")):
+        return "y"
+    return "z"
+
+class SphereQuadrature():
+    # Nodes for integrating a pattern over the full sphere. The polar angle is
+    # measured from the axis the pattern is symmetric about (mu = cos of it)
+    # and uses Gauss-Legendre nodes. For the perpendicular array, which has no
+    # axis of symmetry, the azimuth psi about the array axis also gets
+    # Gauss-Legendre nodes over one quadrant, the dipole factor being even in
+    # cos(psi). psi = 0 points along the dipole, so cos(theta) = sin(gamma)cos(psi).
+    # 256 polar nodes resolve arrays up to N * d of about 40 wavelengths.
+    def __init__(self, polar=256, azimuth=16, peak=1024):
+        mu, weights = np.polynomial.legendre.leggauss(polar)
+        psi, psiWeights = np.polynomial.legendre.leggauss(azimuth)
+        self.mu = readOnly(mu)
+        self.sinMu = readOnly(np.sqrt(1 - mu**2))
+        self.invSinMu = axisInverse(self.sinMu)
+        self.weights = readOnly(weights)
+        psi = (psi + 1) * pi / 4
+        self.psiWeights = readOnly(psiWeights * pi)
+        self.cosZ = readOnly(np.multiply.outer(self.sinMu, cos(psi)))
+        self.invSinZ = axisInverse(np.sqrt(1 - self.cosZ**2))
+        # sin(theta) samples for the perpendicular array peak search
+        self.peakS = readOnly(np.linspace(0, 1, peak + 1)[1:])
+        self.peakC = readOnly(np.sqrt(1 - self.peakS**2))
+        self.invPeakS = axisInverse(self.peakS)
+
+QUADRATURE = SphereQuadrature()
+
+### /ANGLE GRIDS ###
+
+### ARRAY FACTOR TABLE ###
+
+class ArrayFactorTable():
+    # The array factor only depends on sigma = 2 pi d cos(gamma) + d_phi and N.
+    # The signed kernel sin(N sigma/2) / (N sin(sigma/2)) is smooth and 4 pi
+    # periodic for any N (2 pi for odd N), its magnitude has a kink at every
+    # null that linear interpolation would round off. One finely sampled
+    # period of the signed kernel per N turns two sines and a divide into a
+    # gather, a linear interpolation and an abs. Tables are built on first use
+    # of each N.
+    def __init__(self, samples=2**16):
+        if(samples & (samples - 1)):
+            raise ValueError("Table size must be a power of two, got %d" % samples)
+        self.samples = samples
+        self.scale = samples / (4 * pi)
+        self.tables = {}
+
+    def table(self, numEle):
+        try:
+            return self.tables[numEle]
+        except KeyError:
+            af = dirichletKernel(numEle, np.arange(self.samples + 1) / (2 * self.scale), signed=True)
+            self.tables[numEle] = (readOnly(af[:-1].copy()), readOnly(np.diff(af)))
+            return self.tables[numEle]
+
+    def lookup(self, numEle, sigma, out=None, index=None):
+        # sigma is used as scratch and overwritten
+        base, slope = self.table(numEle)
+        np.multiply(sigma, self.scale, out=sigma)
+        out = np.floor(sigma, out=out)
+        np.subtract(sigma, out, out=sigma)
+        if index is None:
+            index = np.empty(out.shape, dtype=np.intp)
+        np.copyto(index, out, casting='unsafe')
+        # Wraps any (also negative) sample number into one period
+        np.bitwise_and(index, self.samples - 1, out=index)
+        slope.take(index, out=out)
+        np.multiply(out, sigma, out=out)
+        np.add(out, base.take(index, out=sigma), out=out)
+        return np.abs(out, out=out)
+
+# Set to None to evaluate the array factor directly
+AF_TABLE = ArrayFactorTable()
+
+### /ARRAY FACTOR TABLE ###
+
+def dipoleFactor(length, cosTheta, invSinTheta, out=None):
+    # Center fed dipole of length [l / lambda], theta measured from the dipole
+    # axis. Takes axisInverse(sin(theta)) so the grids pay for the division once.
+    kl = np.multiply(length, pi)
+    out = np.multiply(kl, cosTheta, out=out)
+    np.cos(out, out=out)
+    np.subtract(out, cos(kl), out=out)
+    np.multiply(out, invSinTheta, out=out)
+    return np.abs(out, out=out)
+
+def dirichletKernel(numEle, halfSigma, out=None, signed=False):
+    # |sin(N x) / (N sin(x))| evaluated as the Chebyshev polynomial U_(N-1)(cos x)
+    # through its three term recurrence. Nothing is divided by sin(x), so main
+    # and grating lobes at sigma = 2 pi k come out as exactly +-1 instead of 0/0.
+    # numEle may be stacked against halfSigma, halfSigma is overwritten. signed
+    # skips the abs.
+    twoT = np.cos(halfSigma, out=halfSigma)
+    np.multiply(twoT, 2, out=twoT)
+    if out is None:
+        out = np.empty(twoT.shape)
+    numEles = np.asarray(numEle)
+    stacked = numEles.ndim > 0
+    last = int(np.max(numEles)) - 1
+    tmp = np.empty(twoT.shape) if stacked else out
+    prev = np.ones(twoT.shape)
+    cur = twoT.copy()
+    if stacked:
+        np.copyto(out, prev, where=(numEles == 1))
+        np.copyto(out, cur, where=(numEles == 2))
+    for n in range(2, last + 1):
+        np.multiply(twoT, cur, out=tmp)
+        np.subtract(tmp, prev, out=prev)
+        prev, cur = cur, prev
+        if stacked:
+            np.copyto(out, cur, where=(numEles == n + 1))
+    if not stacked:
+        np.copyto(out, prev if last == 0 else cur)
+    if not signed:
+        np.abs(out, out=out)
+    return np.divide(out, numEles, out=out)
+
+def arrayFactorCos(d, d_phi, numEle, cosGamma, out=None, work=None, index=None):
+    # Uniform linear array, gamma measured from the array axis
+    if(AF_TABLE is not None and np.ndim(numEle) == 0):
+        sigma = np.multiply(np.multiply(2 * pi, d), cosGamma, out=work)
+        np.add(sigma, d_phi, out=sigma)
+        return AF_TABLE.lookup(int(numEle), sigma, out=out, index=index)
+    halfSigma = np.multiply(np.multiply(pi, d), cosGamma, out=work)
+    np.add(halfSigma, np.multiply(d_phi, 0.5), out=halfSigma)
+    return dirichletKernel(numEle, halfSigma, out=out)
+
+def dipolePattern(length, theta):
+    return dipoleFactor(length, cos(theta), axisInverse(sin(theta)))
+
+def arrayFactor(d, d_phi, numEle, gamma):
+    return arrayFactorCos(d, d_phi, numEle, cos(gamma))
+
+def normalize(pattern, out=None):
+    # Patterns may be stacked, the angle is always the last axis
+    return np.divide(pattern, np.amax(pattern, axis=-1, keepdims=True), out=out)
+
+def stackedParam(value):
+    # Adds the azimuth axis to a parameter stacked as (batch, 1)
+    return np.expand_dims(value, -1) if np.ndim(value) else value
+
+# Below this length the Si/Ci terms of the dipole integral cancel to noise
+CLOSED_FORM_MIN_LENGTH = 0.01
+
+def unstack(value):
+    # Drops the angle axis of a parameter stacked as (batch, 1)
+    return np.asarray(value)[..., 0] if np.ndim(value) else value
+
+def dipoleRadiationIntegral(length):
+    # integral_0^pi F(theta)^2 sin(theta) dtheta of the dipole factor, in
+    # closed form from the sine and cosine integrals (Balanis 4-68)
+    kl = 2 * pi * np.asarray(length)
+    si1, ci1 = special.sici(kl)
+    si2, ci2 = special.sici(2 * kl)
+    return (np.euler_gamma + np.log(kl) - ci1
+            + 0.5 * sin(kl) * (si2 - 2 * si1)
+            + 0.5 * cos(kl) * (np.euler_gamma + np.log(kl / 2) + ci2 - 2 * ci1))
+
+def arrayRadiationIntegral(d, d_phi, numEle):
+    # integral(|AF|^2 dOmega) / 4 pi of the uniform linear array. Expanding
+    # |AF|^2 = (1/N^2) sum_p (N - |p|) cos(p sigma) leaves one sinc per lag p.
+    # Needs d > 0, co-located elements are isotropic.
+    p = np.arange(1, numEle)
+    kdp = np.multiply(2 * pi * np.asarray(d), p)
+    lags = (numEle - p) * cos(np.multiply(d_phi, p)) * sin(kdp) / kdp
+    return (numEle + 2 * np.sum(lags, axis=-1)) / numEle**2
+
+def directivity(params, peak, quad=None, closedForm=True):
+    # D = 4 pi U_max / integral(U dOmega) over the full sphere, with U = |F|^2.
+    # peak is the largest |F| found on the 2D cuts, in the same units as the
+    # unnormalized factors evaluated here. The dipole and the plain array have
+    # closed forms, everything else is integrated numerically.
+    if quad is None:
+        quad = QUADRATURE
+    length, d, d_phi, N = params.len, params.d, params.d_phi, params.numEle
+    peak = np.asarray(peak)[..., 0]
+    if(isinstance(quad, EqualAreaGrid)):
+        # Every lattice point carries the same weight, so the integral is a mean
+        F = rawPattern3D(params, quad)
+        peak = np.maximum(peak, np.amax(F, axis=-1))
+        integral = 4 * pi * np.mean(np.square(F, out=F), axis=-1)
+        return np.round(4 * pi * peak**2 / integral, 2), peak
+    if(closedForm and params.simType == "Single Dipole" and np.min(length) >= CLOSED_FORM_MIN_LENGTH):
+        return np.round(2 * peak**2 / dipoleRadiationIntegral(unstack(length)), 2), peak
+    if(closedForm and params.simType == "Antenna Array" and params.arrType == "NoDip"
+       and np.ndim(N) == 0 and np.min(d) > 0):
+        return np.round(peak**2 / arrayRadiationIntegral(d, d_phi, int(N)), 2), peak
+    if(params.simType == "Single Dipole"):
+        F = dipoleFactor(length, quad.mu, quad.invSinMu)
+    elif(params.arrType == "NoDip"):
+        F = arrayFactorCos(d, d_phi, N, quad.mu)
+    elif(params.arrType == "ColArray"):
+        F = dipoleFactor(length, quad.mu, quad.invSinMu)
+        F *= arrayFactorCos(d, d_phi, N, quad.mu)
+    elif(params.arrType == "PerpArray"):
+        # The cuts miss the peak of dipoles longer than ~1.25 wavelengths. At
+        # sin(theta) = s the array axis angle spans |cos(gamma)| <= s, so the
+        # peak is the max over s of dipole(s) * (array factor max up to s)
+        arrMax = np.maximum(arrayFactorCos(d, d_phi, N, quad.peakS), arrayFactorCos(d, d_phi, N, -quad.peakS))
+        arrMax = np.maximum.accumulate(arrMax, axis=-1)
+        peak = np.maximum(peak, np.amax(dipoleFactor(length, quad.peakC, quad.invPeakS) * arrMax, axis=-1))
+        F = dipoleFactor(stackedParam(length), quad.cosZ, quad.invSinZ)
+        F *= arrayFactorCos(d, d_phi, N, quad.mu)[..., np.newaxis]
+        integral = np.dot(np.dot(np.square(F, out=F), quad.psiWeights), quad.weights)
+        return np.round(4 * pi * peak**2 / integral, 2), peak
+    else:
+        raise ValueError("Unknown antenna configuration: %s / %s" % (params.simType, params.arrType))
+    integral = 2 * pi * np.dot(np.square(F, out=F), quad.weights)
+    return np.round(4 * pi * peak**2 / integral, 2), peak
+
+def isPerpArray(params):
+    return params.simType == "Antenna Array" and params.arrType == "PerpArray"
+
+def elementFactor2D(params, grid):
+    # Dipole element pattern, None when the configuration has no dipole
+    if(params.simType == "Antenna Array" and params.arrType == "NoDip"):
+        return None
+    if(isPerpArray(params)):
+        # Dipole axis is rotated pi/2 from the array axis: cos -> sin, |sin| -> |cos|
+        return dipoleFactor(params.len, grid.sin, grid.invCos)
+    return dipoleFactor(params.len, grid.cos, grid.invSin)
+
+def arrayFactor2D(params, grid, work=None, index=None):
+    # None when the configuration is a single element
+    if(params.simType == "Single Dipole"):
+        return None
+    return arrayFactorCos(params.d, params.d_phi, params.numEle, grid.cos, work=work, index=index)
+
+def combineFactors2D(params, element, arrFact, grid):
+    # Returns the normalized (E-plane, H-plane) patterns, the unnormalized
+    # E-plane peak and the largest unnormalized field seen on either cut
+    if(params.simType == "Single Dipole"):
+        eRad = element.copy()
+        hRad = np.broadcast_to(grid.ones, np.shape(eRad))
+    elif(params.arrType == "NoDip"):
+        eRad = arrFact.copy()
+        hRad = np.broadcast_to(grid.ones, np.shape(eRad))
+    elif(params.arrType == "ColArray"):
+        eRad = element * arrFact
+        hRad = np.broadcast_to(grid.ones, np.shape(eRad))
+    elif(params.arrType == "PerpArray"):
+        eRad = element * arrFact
+        hRad = normalize(arrFact)
+    else:
+        raise ValueError("Unknown antenna configuration: %s / %s" % (params.simType, params.arrType))
+    ePeak = np.amax(eRad, axis=-1, keepdims=True)
+    peak = ePeak
+    if(isPerpArray(params)):
+        # H-plane is broadside to the dipole, where its factor is |1 - cos(pi l)|
+        hPeak = np.abs(1 - cos(np.multiply(params.len, pi))) * np.amax(arrFact, axis=-1, keepdims=True)
+        peak = np.maximum(ePeak, hPeak)
+    np.divide(eRad, ePeak, out=eRad)
+    return eRad, hRad, ePeak, peak
+
+def directivityPattern(params, eRad, ePeak, peak, quad=None):
+    # The directivity cut is scaled to the sphere's peak, which only differs
+    # from the E-plane's own peak for the perpendicular array
+    direc, spherePeak = directivity(params, peak, quad)
+    scale = direc * (np.asarray(ePeak)[..., 0] / spherePeak)**2
+    DtPat = np.square(eRad)
+    np.multiply(DtPat, np.asarray(scale)[..., np.newaxis], out=DtPat)
+    return direc, DtPat
+
+def pattern2D(params, theta, quad=None):
+    grid = AngleGrid.of(theta)
+    eRad, hRad, ePeak, peak = combineFactors2D(params, elementFactor2D(params, grid),
+                                               arrayFactor2D(params, grid), grid)
+    direc, DtPat = directivityPattern(params, eRad, ePeak, peak, quad)
+    return Pattern2D(eRad, hRad, direc, DtPat)
+
+### BATCH EVALUATION ###
+
+# Upper bound on (configurations x samples) evaluated in one broadcasted pass
+BATCH_MAX_ELEMENTS = 2**21
+
+def batchRowSamples(simType, arrType, size):
+    # Samples each configuration keeps in flight: its angle grid, or the
+    # directivity quadrature when that is larger
+    if(simType == "Antenna Array" and arrType == "PerpArray"):
+        return max(size, QUADRATURE.cosZ.size + QUADRATURE.peakS.size)
+    return max(size, QUADRATURE.mu.size)
+
+def patternBatch(simType, arrType, lengths, ds, d_phis, numEles, theta, chunkSize=None):
+    # lengths, ds, d_phis and numEles broadcast against each other to one
+    # batch of configurations, results are stacked as (batch, angle)
+    lengths, ds, d_phis, numEles = np.broadcast_arrays(np.ravel(lengths), np.ravel(ds),
+                                                       np.ravel(d_phis), np.ravel(numEles))
+    batch = lengths.shape[0]
+    grid = AngleGrid.of(theta)
+    size = grid.theta.shape[0]
+    if chunkSize is None:
+        chunkSize = max(1, BATCH_MAX_ELEMENTS // batchRowSamples(simType, arrType, size))
+    eRad = np.empty((batch, size))
+    hRad = np.empty((batch, size))
+    DtPat = np.empty((batch, size))
+    direc = np.empty(batch)
+    # Rows are grouped by element count so each chunk shares one array factor table
+    for numEle in np.unique(numEles):
+        group = np.flatnonzero(numEles == numEle)
+        for start in range(0, group.shape[0], chunkSize):
+            rows = group[start:start + chunkSize]
+            params = AntennaParams(simType, arrType,
+                                   lengths[rows, np.newaxis], ds[rows, np.newaxis],
+                                   d_phis[rows, np.newaxis], numEle)
+            pattern = pattern2D(params, grid)
+            eRad[rows] = pattern.eRad
+            hRad[rows] = pattern.hRad
+            DtPat[rows] = pattern.DtPat
+            direc[rows] = pattern.direc
+    return Pattern2D(eRad, hRad, direc, DtPat)
+
+### /BATCH EVALUATION ###
+
+### ADAPTIVE RESOLUTION ###
+
+def fieldEPlane(params, grid):
+    # Unnormalized E-plane field
+    element = elementFactor2D(params, grid)
+    arrFact = arrayFactor2D(params, grid)
+    if element is None:
+        return arrFact
+    if arrFact is None:
+        return element
+    return element * arrFact
+
+def lobeCount(params):
+    # Rough number of lobes across the -pi..pi cut, sizes the coarse grid
+    lobes = 2
+    if(usesElement(params)):
+        lobes += int(np.ceil(4 * params.len))
+    if(usesArrayFactor(params)):
+        lobes += int(np.ceil(4 * params.d * params.numEle))
+    return lobes
+
+def adaptiveGrid(params, tol=1e-3, coarse=256, maxPoints=2**16, maxDepth=12):
+    # Starts from a uniform cut with a few samples per lobe and bisects every
+    # interval whose midpoint misses the linear interpolation by more than tol
+    # (relative to the peak). Curvature is highest at lobe peaks and nulls, so
+    # that is where the samples end up. Bounding the interpolation error
+    # bounds the error of the sampled peak, of the interpolated -3 dB points
+    # and of the directivity, which is computed from the peak. Intervals are
+    # split at most maxDepth times so rounding noise cannot refine forever.
+    coarse = max(coarse, 8 * lobeCount(params))
+    minWidth = 2 * pi / coarse / 2**maxDepth
+    theta = np.linspace(-pi, pi, coarse + 1)
+    field = fieldEPlane(params, AngleGrid(theta))
+    active = np.ones(coarse, dtype=bool)
+    while(active.any() and theta.shape[0] < maxPoints):
+        idx = np.flatnonzero(active)
+        mid = (theta[idx] + theta[idx + 1]) / 2
+        fMid = fieldEPlane(params, AngleGrid(mid))
+        peak = max(np.amax(field), np.amax(fMid))
+        failed = idx[(np.abs(fMid - (field[idx] + field[idx + 1]) / 2) > tol * peak)
+                     & (theta[idx + 1] - theta[idx] > minWidth)]
+        split = np.zeros(active.shape, dtype=bool)
+        split[failed] = True
+        theta = np.insert(theta, failed + 1, mid[split[idx]])
+        field = np.insert(field, failed + 1, fMid[split[idx]])
+        # Only the halves of a split interval need testing again
+        active = np.repeat(split, np.where(split, 2, 1))
+    return theta
+
+def adaptivePattern2D(params, tol=1e-3, quad=None):
+    theta = adaptiveGrid(params, tol)
+    return theta, pattern2D(params, theta, quad)
+
+def halfPowerBeamwidth(theta, eRad, tie=1e-3):
+    # Width of the main lobe between its -3 dB points, nan when the pattern
+    # does not drop to half power on both sides within the cut. Every lobe
+    # peaking within tie of the largest sample (grating lobes) counts as the
+    # main lobe and the widest of them is reported, so the result doesn't
+    # depend on which one the sampling happens to catch highest.
+    half = np.sqrt(0.5)
+    eRad = np.asarray(eRad)
+    top = np.flatnonzero(eRad >= np.amax(eRad) - tie)
+    peaks = top[np.r_[True, np.diff(top) > 1]]
+    below = np.flatnonzero(eRad < half)
+    width = np.nan
+    for peak in peaks:
+        k = np.searchsorted(below, peak)
+        if(k == 0 or k == below.size):
+            continue
+        i, j = below[k - 1], below[k]
+        thetaLeft = theta[i] + (half - eRad[i]) * (theta[i + 1] - theta[i]) / (eRad[i + 1] - eRad[i])
+        thetaRight = theta[j - 1] + (half - eRad[j - 1]) * (theta[j] - theta[j - 1]) / (eRad[j] - eRad[j - 1])
+        width = np.fmax(width, thetaRight - thetaLeft)
+    return width
+
+### /ADAPTIVE RESOLUTION ###
+
+def rawPattern3D(params, sphere):
+    # Unnormalized |F| on a SphereGrid or EqualAreaGrid. Factors come out
+    # shaped like the cosine they are evaluated on, so only the ones that
+    # depend on the azimuth pay for the full mesh. Stacked parameters get
+    # their own outputs rather than the grid's buffers.
+    length, d, d_phi, N = params.len, params.d, params.d_phi, params.numEle
+    if(any(np.ndim(value) for value in params[2:])):
+        work, work2, index = None, None, None
+    else:
+        work, work2, index = sphere.work, sphere.work2, sphere.index
+    if(params.simType == "Single Dipole"):
+        rad3D = dipoleFactor(length, sphere.cosTheta, sphere.invSinTheta)
+    elif(params.arrType == "NoDip"):
+        rad3D = arrayFactorCos(d, d_phi, N, sphere.cosGamma, work=work, index=index)
+    elif(params.arrType == "ColArray"):
+        rad3D = dipoleFactor(length, sphere.cosGamma, sphere.invSinGamma)
+        rad3D *= arrayFactorCos(d, d_phi, N, sphere.cosGamma, out=work, work=work2, index=index)
+    elif(params.arrType == "PerpArray"):
+        rad3D = dipoleFactor(length, sphere.cosTheta, sphere.invSinTheta)
+        rad3D = rad3D * arrayFactorCos(d, d_phi, N, sphere.cosGamma, out=work, work=work2, index=index)
+    else:
+        raise ValueError("Unknown antenna configuration: %s / %s" % (params.simType, params.arrType))
+    return rad3D
+
+def pattern3D(params, sphere):
+    rad3D = rawPattern3D(params, sphere)
+    rad3D /= np.amax(rad3D)
+    return np.broadcast_to(rad3D, sphere.shape)
+
+### PATTERN CUTS ###
+
+def cutAxis(params):
+    # Axis the 2D patterns measure their angle from: the dipole axis for a
+    # single dipole, the array axis for every array
+    if(params.simType == "Single Dipole"):
+        return "z"
+    return "y"
+
+def cutDirections(angles, phi=None, theta=None, axis="z"):
+    # A phi cut sweeps the polar angle through the plane at azimuth phi,
+    # negative angles landing on the phi + pi half. A conical cut sweeps the
+    # azimuth at fixed polar angle theta. Both are taken about `axis` with
+    # the same orientation as a SphereGrid on it, so with axis "y" the cut at
+    # phi = 90 deg is the y-z plane.
+    if((phi is None) == (theta is None)):
+        raise ValueError("A cut needs exactly one of phi or theta")
+    if(phi is not None):
+        cosPolar = cos(angles)
+        across, along = sin(angles) * cos(phi), sin(angles) * sin(phi)
+    else:
+        cosPolar = np.full(np.shape(angles), cos(theta))
+        across, along = sin(theta) * cos(angles), sin(theta) * sin(angles)
+    if(axis == "z"):
+        return across, along, cosPolar
+    if(axis == "y"):
+        return across, cosPolar, along
+    raise ValueError("Unknown sphere axis: %s" % axis)
+
+def patternCut(params, angles, phi=None, theta=None, axis="z"):
+    # Direct evaluation along the cut, normalized to the cut's own peak
+    return normalize(rawPattern3D(params, DirectionGrid(*cutDirections(angles, phi, theta, axis))))
+
+def interpolateCut(sphere, rad3D, angles, phi=None, theta=None, axis="z"):
+    # Bilinear interpolation of a field sampled on a SphereGrid, which is
+    # uniform in its polar angle and azimuth about its own axis. The cut's
+    # axis needn't be the same one.
+    ux, uy, uz = cutDirections(angles, phi, theta, axis)
+    if(sphere.axis == "z"):
+        polar, azimuth = np.arccos(np.clip(uz, -1, 1)), np.arctan2(uy, ux)
+    else:
+        polar, azimuth = np.arccos(np.clip(uy, -1, 1)), np.arctan2(uz, ux)
+    rad3D = np.asarray(rad3D)
+    rows, cols = rad3D.shape
+    col = (polar - sphere.polar[0]) * ((cols - 1) / (sphere.polar[-1] - sphere.polar[0]))
+    row = (azimuth - sphere.azimuth[0]) * ((rows - 1) / (sphere.azimuth[-1] - sphere.azimuth[0]))
+    i = np.clip(np.floor(col).astype(np.intp), 0, cols - 2)
+    j = np.clip(np.floor(row).astype(np.intp), 0, rows - 2)
+    t = col - i
+    s = row - j
+    cut = ((1 - s) * ((1 - t) * rad3D[j, i] + t * rad3D[j, i + 1])
+           + s * ((1 - t) * rad3D[j + 1, i] + t * rad3D[j + 1, i + 1]))
+    return normalize(cut)
+
+### /PATTERN CUTS ###
+
+### /PATTERN ENGINE ###
+
+### PATTERN CACHE ###
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+# Slider steps are 0.01 wavelengths and whole degrees, anything finer is float noise
+KEY_DECIMALS = 6
+
+def patternKey(params):
+    # Parameters a configuration ignores are dropped so equivalent states share an entry
+    length = round(float(params.len), KEY_DECIMALS)
+    d = round(float(params.d), KEY_DECIMALS)
+    d_phi = round(float(params.d_phi), KEY_DECIMALS)
+    numEle = int(params.numEle)
+    if(params.simType == "Single Dipole"):
+        return (params.simType, None, length, None, None, None)
+    if(params.arrType == "NoDip"):
+        length = None
+    return (params.simType, params.arrType, length, d, d_phi, numEle)
+
+# Memory budgets for the AntennaProfile caches. A 2D state at the default
+# 10000 samples is 160-240 kB, so these hold about 150 and 20 states.
+PATTERN_CACHE_BYTES = 32 * 2**20
+PREFETCH_CACHE_BYTES = 4 * 2**20
+
+def entryBytes(value):
+    # Memory held by the arrays in a cached value. Broadcast views (zero
+    # strides) share their memory with a grid table and aren't counted.
+    if(isinstance(value, np.ndarray)):
+        return value.nbytes if 0 not in value.strides else 0
+    if(isinstance(value, (tuple, list))):
+        return sum(entryBytes(item) for item in value)
+    return 0
+
+class PatternCache():
+    # LRU bounded by entry count and, with maxbytes, by entryBytes of the
+    # values. The newest entry is always kept.
+    def __init__(self, maxsize=512, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.currbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, compute):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = compute()
+            self.put(key, value)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.pop(key)
+        self.entries[key] = value
+        self.sizes[key] = entryBytes(value) if self.maxbytes is not None else 0
+        self.currbytes += self.sizes[key]
+        while(len(self.entries) > 1 and (len(self.entries) > self.maxsize or
+              (self.maxbytes is not None and self.currbytes > self.maxbytes))):
+            self.pop(next(iter(self.entries)))
+
+    def pop(self, key):
+        # Takes the entry out, None when it isn't cached
+        if(key not in self.entries):
+            return None
+        self.currbytes -= self.sizes.pop(key)
+        return self.entries.pop(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.currbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def cacheInfo(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.entries))
+
+# 3D meshes only depend on their size and axis, so toggling the 3D plot or
+# changing the element count reuses the trig tables instead of rebuilding them
+SPHERE_GRIDS = PatternCache(maxsize=8)
+
+def sphereGrid(size, axis="z"):
+    return SPHERE_GRIDS.get((int(size), axis), lambda: SphereGrid(np.linspace(0, pi, int(size)),
+                                                                   np.linspace(-pi, pi, int(size)), axis))
+
+def equalAreaGrid(points):
+    return SPHERE_GRIDS.get(("equalArea", int(points)), lambda: EqualAreaGrid(int(points), triangulate=True))
+
+### /PATTERN CACHE ###
+
+### FACTOR GRAPH ###
+
+# The 2D pattern is split into nodes that only recompute when their own
+# inputs change: a phasing change reuses the element pattern, a length
+# change reuses the array factor.
+
+def usesElement(params):
+    return not (params.simType == "Antenna Array" and params.arrType == "NoDip")
+
+def usesArrayFactor(params):
+    return params.simType != "Single Dipole"
+
+def elementKey(params):
+    return (round(float(params.len), KEY_DECIMALS), isPerpArray(params))
+
+def arrayFactorKey(params):
+    return (round(float(params.d), KEY_DECIMALS), round(float(params.d_phi), KEY_DECIMALS), int(params.numEle))
+
+class FactorNode():
+    def __init__(self, compute):
+        self.compute = compute
+        self.inputs = None
+        self.value = None
+        self.version = 0
+
+    def get(self, inputs, *args):
+        if(self.version == 0 or inputs != self.inputs):
+            self.value = self.compute(*args)
+            self.inputs = inputs
+            self.version += 1
+        return self.value
+
+class PatternGraph():
+    # Node values are shared with the pattern cache and must not be modified,
+    # only the grid's scratch buffers are written to
+    def __init__(self, grid):
+        self.grid = grid
+        self.element = FactorNode(lambda params: elementFactor2D(params, grid))
+        self.arrFact = FactorNode(lambda params: arrayFactor2D(params, grid, work=grid.work, index=grid.index))
+        self.normalized = FactorNode(lambda params, element, arrFact:
+                                     combineFactors2D(params, element, arrFact, grid))
+        self.direc = FactorNode(lambda params, eRad, ePeak, peak: directivityPattern(params, eRad, ePeak, peak))
+
+    def evaluate(self, params):
+        element = None
+        arrFact = None
+        if(usesElement(params)):
+            element = self.element.get(elementKey(params), params)
+        if(usesArrayFactor(params)):
+            arrFact = self.arrFact.get(arrayFactorKey(params), params)
+        eRad, hRad, ePeak, peak = self.normalized.get((params.simType, params.arrType,
+                                          element is not None and self.element.version,
+                                          arrFact is not None and self.arrFact.version),
+                                         params, element, arrFact)
+        with TIMER.stage("directivity"):
+            direc, DtPat = self.direc.get(self.normalized.version, params, eRad, ePeak, peak)
+        return Pattern2D(eRad, hRad, direc, DtPat)
+
+### /FACTOR GRAPH ###
 
 class AntennaProfile():
+    # compute2D/compute3D only touch the pattern engine and may run on a
+    # worker thread, the lock keeps the cache and scratch buffers to one
+    # caller. apply2D/apply3D store results for the figure.
     def __init__(self, Plots):
+        self.lock = threading.Lock()
+        self.cache = PatternCache(maxbytes=PATTERN_CACHE_BYTES)
+        # 3D fields are keyed by the grid object itself along with the state
+        self.cache3D = PatternCache(maxsize=16)
+        # Prefetched 2D and 3D results get their own small budget so guesses
+        # can't push out the states that were actually shown
+        self.prefetched = PatternCache(maxsize=32, maxbytes=PREFETCH_CACHE_BYTES)
+        self.prefetchHits = 0
+        self.cacheGrid = None
+        self.graph = None
+        self.rad3D = None
+        self.rad3DKey = None
         self.init2DPlot(Plots)
-        self.direc = self.getDirectivity(Plots)
-        self.DtPat = self.initDirPlot()
 
     def init2DPlot(self, Plots):
-        self.eRad2D = abs(((cos(Plots.len*pi*cos(Plots.theta2D)) - cos(Plots.len*pi))/sin(Plots.theta2D)))
-        self.eRad2D = np.divide(self.eRad2D, np.amax(self.eRad2D))
-        self.hRad2D = np.ones(Plots.theta2D.shape[0])
+        self.update_2DPlot(Plots)
 
     def initDirPlot(self):
         return self.direc * self.eRad2D**2
 
+    def cached(self, cache, key, compute, speculative):
+        # A speculative result only goes into the prefetch cache, and returns
+        # None if the state is cached already. A prefetched entry moves over
+        # to the main cache the first time it is really asked for, and counts
+        # in prefetchHits rather than as a hit or miss of the main cache.
+        if(speculative):
+            if(key in cache):
+                return None
+            return self.prefetched.get(key, compute)
+        if(key not in cache):
+            value = self.prefetched.pop(key)
+            if(value is not None):
+                self.prefetchHits += 1
+                cache.put(key, value)
+                return value
+        return cache.get(key, compute)
+
+    def compute2D(self, params, adaptive=False, tolerance=1e-3, theta=None, speculative=False):
+        with self.lock, TIMER.stage("compute2D"):
+            if(adaptive):
+                # Every state gets its own grid, cached together with the pattern
+                key = ("adaptive", tolerance) + patternKey(params)
+                return self.cached(self.cache, key, lambda: adaptivePattern2D(params, tolerance), speculative)
+            if(self.cacheGrid is not theta):
+                # Cached patterns are only valid for the grid they were sampled on
+                self.cache.clear()
+                self.prefetched.clear()
+                self.prefetchHits = 0
+                self.cacheGrid = theta
+                self.grid = AngleGrid(theta)
+                self.graph = PatternGraph(self.grid)
+            return theta, self.cached(self.cache, patternKey(params), lambda: self.graph.evaluate(params), speculative)
+
+    def apply2D(self, params, gamma, pattern):
+        self.params2D = params
+        self.gamma = gamma
+        self.eRad2D = pattern.eRad
+        self.hRad2D = pattern.hRad
+        self.direc = pattern.direc
+        self.DtPat = pattern.DtPat
+
     def update_2DPlot(self, Plots):
-        if(Plots.simType == "Single Dipole"):
-            self.eRad2D = abs(((cos(Plots.len*pi*cos(Plots.theta2D)) - cos(Plots.len*pi))/sin(Plots.theta2D)))
-            self.hRad2D = np.ones(Plots.theta2D.shape[0])
-        elif(Plots.simType == "Antenna Array"):
-            if(Plots.arrType == "NoDip"):
-                sigma = np.add (2 * pi * Plots.d * cos(Plots.theta2D), Plots.d_phi)
-                N = Plots.numEle
-                self.arrFact = (1 / N) * np.abs(np.divide(sin(N * sigma /2), sin(sigma / 2)))
-                self.eRad2D = np.divide(self.arrFact, np.max(self.arrFact))
-            elif(Plots.arrType == "ColArray"):
-                self.gamma = Plots.theta2D
-                self.antPat = abs(((cos(Plots.len*pi*cos(Plots.theta2D)) - cos(Plots.len*pi))/sin(Plots.theta2D)))
-                self.antPat = np.divide(self.antPat, np.amax(self.antPat))
-                sigma = np.add (2 * pi * Plots.d * cos(self.gamma), Plots.d_phi)
-                N = Plots.numEle
-                self.arrFact = (1 / N) * np.abs(np.divide(sin(N * sigma /2), sin(sigma / 2)))
-                self.eRad2D = np.multiply(self.antPat, self.arrFact)
-                self.hRad2D = np.ones(Plots.theta2D.shape[0])
-            elif(Plots.arrType == "PerpArray"):
-                self.gamma = Plots.theta2D
-                sigma = np.add (2 * pi * Plots.d * cos(self.gamma), Plots.d_phi)
-                N = Plots.numEle
-                self.arrFact = (1 / N) * np.abs(np.divide(sin(N * sigma /2), sin(sigma / 2)))
-                self.antPat = abs(((cos(Plots.len*pi*cos(Plots.theta2D - pi / 2)) - cos(Plots.len*pi))/sin(Plots.theta2D - pi / 2)))
-                self.antPat = np.divide(self.antPat, np.amax(self.antPat))
-                self.eRad2D = np.multiply(self.antPat, self.arrFact)
-                self.hRad2D = self.arrFact
-        self.hRad2D = np.divide(self.hRad2D, np.max(self.hRad2D))
-        self.eRad2D = np.divide(self.eRad2D, np.amax(self.eRad2D))
-        self.direc = self.getDirectivity(Plots)
-        self.DtPat = self.direc * self.eRad2D**2
+        params = AntennaParams.fromPlots(Plots)
+        self.apply2D(params, *self.compute2D(params, Plots.adaptive2D, Plots.tolerance2D, Plots.theta2D))
 
     def getDirectivity(self, Plots):
-        I = integrate.cumtrapz(self.eRad2D[5000:len(self.eRad2D)] ** 2 * sin(Plots.theta2D[5000:len(Plots.theta2D)]),Plots.theta2D[5000:len(Plots.theta2D)], initial=0)
-        return round((2 / I[len(I)-1]), 2)
+        return self.direc
+
+    def compute3D(self, params, sphere, speculative=False):
+        with self.lock, TIMER.stage("compute3D"):
+            return self.cached(self.cache3D, (sphere,) + patternKey(params),
+                               lambda: pattern3D(params, sphere), speculative)
+
+    def apply3D(self, params, sphere, rad3D):
+        self.rad3D = rad3D
+        self.rad3DKey = patternKey(params)
+        self.sphere3D = sphere
 
     def init_3DPlot(self, Plots):
-        if(Plots.simType == "Single Dipole"):
-            self.antPat3D = ((cos(Plots.len*pi*cos(Plots.THETA)) - cos(Plots.len*pi))/sin(Plots.THETA))
-            self.antPat3D = np.divide(self.antPat3D, np.amax(self.antPat3D))
-            self.rad3D = self.antPat3D
-        elif(Plots.simType == "Antenna Array"):
-            if(Plots.arrType == "NoDip"):
-                sigma = np.add (2 * pi * Plots.d * cos(Plots.gamma3D), Plots.d_phi)
-                N = Plots.numEle
-                self.arrFact3D = (1 / N) * np.abs(np.divide(sin(N * sigma /2), sin(sigma / 2)))
-                self.rad3D = np.divide(self.arrFact3D,np.max(self.arrFact3D))
-            elif(Plots.arrType == "ColArray"):
-
-                sigma = np.add (2 * pi * Plots.d * cos(Plots.gamma3D), Plots.d_phi)
-                N = Plots.numEle
-                self.arrFact3D = (1 / N) * np.abs(np.divide(sin(N * sigma /2), sin(sigma / 2)))
-
-                self.antPat3D = ((cos(Plots.len*pi*cos(Plots.gamma3D)) - cos(Plots.len*pi))/sin(Plots.gamma3D))
-                self.antPat3D = np.divide(self.antPat3D, np.amax(self.antPat3D))
-
-                self.rad3D = np.multiply(self.antPat3D, self.arrFact3D)
-                self.rad3D = np.divide(self.rad3D, np.max(self.rad3D))
-            elif(Plots.arrType == "PerpArray"):
-
-                sigma = np.add (2 * pi * Plots.d * cos(Plots.gamma3D), Plots.d_phi)
-                N = Plots.numEle
-                self.arrFact3D = (1 / N) * np.abs(np.divide(sin(N * sigma /2), sin(sigma / 2)))
-
-                self.antPat3D = ((cos(Plots.len*pi*cos(Plots.THETA)) - cos(Plots.len*pi))/sin(Plots.THETA))
-                self.antPat3D = np.divide(self.antPat3D, np.amax(self.antPat3D))
-
-                self.rad3D = np.multiply(self.antPat3D, self.arrFact3D)
-                self.rad3D = np.divide(self.rad3D, np.max(self.rad3D))
+        params = AntennaParams.fromPlots(Plots)
+        self.apply3D(params, Plots.sphere, self.compute3D(params, Plots.sphere))
+
+    def computeCut(self, params, gamma, phi=None, theta=None):
+        # Swept over the same angles as the 2D patterns and about the axis
+        # they are measured from, so it lines up with them on the same plots.
+        # Always evaluated directly: reading it out of the 3D field
+        # (interpolateCut) costs as much and is off by several percent of the
+        # peak near nulls on the plot meshes. Only touches the pattern engine,
+        # like compute2D.
+        return patternCut(params, gamma, phi, theta, cutAxis(params))
+
+    def getCut(self, Plots, phi=None, theta=None):
+        return self.computeCut(AntennaParams.fromPlots(Plots), self.gamma, phi, theta)
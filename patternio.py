@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Pattern Export Module for Antenna Simulator
+
+Saves computed patterns and the parameters behind them, either as a single
+.npz archive or as a directory of raw .npy arrays plus a JSON metadata file.
+The raw layout can be memory-mapped on load, so large sweeps are paged in
+as they are read instead of being loaded whole. The 3D radiation surface can
+also be written as an STL, PLY or OBJ triangle mesh.
+"""
+
+import json
+import os
+
+import numpy as np
+import antennas as ant
+
+# Bumped whenever the array names or metadata keys change meaning
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+### RECORDS ###
+
+def paramsMeta(params):
+    return {"simType": params.simType, "arrType": params.arrType, "len": float(params.len),
+            "d": float(params.d), "d_phi": float(params.d_phi), "numEle": int(params.numEle)}
+
+def profileRecord(Plots):
+    # What the figure currently shows: the 2D cuts, and the 3D field with its
+    # angles when it was computed for the current parameters
+    params = ant.AntennaParams.fromPlots(Plots)
+    prof = Plots.antProf
+    arrays = {"theta": prof.gamma, "eRad": prof.eRad2D, "hRad": prof.hRad2D, "DtPat": prof.DtPat}
+    meta = {"kind": "profile", "params": paramsMeta(params), "direc": float(prof.direc)}
+    if(prof.rad3DKey == ant.patternKey(params)):
+        arrays["rad3D"] = prof.rad3D
+        arrays["THETA"] = prof.sphere3D.THETA
+        arrays["PHI"] = prof.sphere3D.PHI
+    return arrays, meta
+
+def batchRecord(simType, arrType, lengths, ds, d_phis, numEles, theta, pattern):
+    # A patternBatch sweep, one row of every pattern array per configuration
+    lengths, ds, d_phis, numEles = np.broadcast_arrays(np.ravel(lengths), np.ravel(ds),
+                                                       np.ravel(d_phis), np.ravel(numEles))
+    arrays = {"len": lengths, "d": ds, "d_phi": d_phis, "numEle": numEles, "theta": theta,
+              "eRad": pattern.eRad, "hRad": pattern.hRad, "direc": pattern.direc, "DtPat": pattern.DtPat}
+    meta = {"kind": "batch", "simType": simType, "arrType": arrType}
+    return arrays, meta
+
+def checkVersion(meta):
+    if(meta.get("version", 0) > FORMAT_VERSION):
+        raise ValueError("Pattern export version %s is newer than this reader (%d)"
+                         % (meta["version"], FORMAT_VERSION))
+    return meta
+
+def storedArray(a, dtype):
+    # dtype (e.g. np.float32 for archives) only applies to floating point
+    # arrays, parameters like numEle keep their own type
+    a = np.asarray(a)
+    if(dtype is not None and np.issubdtype(a.dtype, np.floating)):
+        return a.astype(dtype, copy=False)
+    return a
+
+### /RECORDS ###
+
+### NPZ ###
+
+def saveNpz(path, arrays, meta, compress=True, dtype=None):
+    # The metadata rides along as a JSON string member
+    meta = dict(meta, version=FORMAT_VERSION)
+    save = np.savez_compressed if compress else np.savez
+    save(path, meta=np.array(json.dumps(meta)), **{name: storedArray(a, dtype) for name, a in arrays.items()})
+
+def loadNpz(path):
+    with np.load(path) as archive:
+        meta = checkVersion(json.loads(str(archive["meta"])))
+        arrays = {name: archive[name] for name in archive.files if name != "meta"}
+    return arrays, meta
+
+### /NPZ ###
+
+### RAW ###
+
+def saveRaw(directory, arrays, meta, dtype=None):
+    # One .npy per array, written through a memmap so the copy streams to disk
+    os.makedirs(directory, exist_ok=True)
+    for name, a in arrays.items():
+        a = storedArray(a, dtype)
+        out = np.lib.format.open_memmap(os.path.join(directory, name + ".npy"), mode='w+',
+                                        dtype=a.dtype, shape=a.shape)
+        out[...] = a
+        out.flush()
+        del out
+    meta = dict(meta, version=FORMAT_VERSION, arrays=sorted(arrays))
+    with open(os.path.join(directory, META_FILE), "w") as f:
+        json.dump(meta, f, indent=1)
+
+def loadRaw(directory, mmap=True):
+    # Arrays come back as read-only memmaps unless mmap is False
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = checkVersion(json.load(f))
+    mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode=mode)
+              for name in meta["arrays"]}
+    return arrays, meta
+
+### /RAW ###
+
+### MESH ###
+
+def surfaceMesh(rad3D, sphere, decimals=9):
+    # Indexed triangle mesh of the radiation surface over a SphereGrid or a
+    # triangulated EqualAreaGrid: (vertices, faces). Samples landing on the
+    # same point (grid seam, poles, nulls at the origin) share one vertex, and
+    # the triangles that collapse with them are dropped.
+    rad3D = np.asarray(rad3D)
+    units = np.stack(np.broadcast_arrays(sphere.ux, sphere.uy, sphere.uz), axis=-1).reshape(-1, 3)
+    points = rad3D.reshape(-1, 1) * units
+    if(getattr(sphere, "triangles", None) is not None):
+        faces = np.array(sphere.triangles, dtype=np.intp)
+    else:
+        index = np.arange(rad3D.size).reshape(rad3D.shape)
+        a, b, c, d = index[:-1, :-1], index[:-1, 1:], index[1:, 1:], index[1:, :-1]
+        faces = np.concatenate((np.stack((a, b, c), axis=-1).reshape(-1, 3),
+                                np.stack((a, c, d), axis=-1).reshape(-1, 3)))
+    # Wind every face counterclockwise seen from outside, judged on the unit
+    # sphere since the pattern surface itself needn't be convex
+    u0, u1, u2 = units[faces[:, 0]], units[faces[:, 1]], units[faces[:, 2]]
+    inward = np.einsum('ij,ij->i', np.cross(u1 - u0, u2 - u0), u0 + u1 + u2) < 0
+    faces[inward] = faces[inward, ::-1]
+    # + 0.0 folds -0.0 into 0.0, np.unique compares the raw bytes
+    keys = np.round(points, decimals) + 0.0
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    faces = inverse.reshape(-1)[faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    return points[first], faces[keep]
+
+def faceNormals(vertices, faces):
+    n = np.cross(vertices[faces[:, 1]] - vertices[faces[:, 0]], vertices[faces[:, 2]] - vertices[faces[:, 0]])
+    length = np.linalg.norm(n, axis=1, keepdims=True)
+    return np.divide(n, length, out=np.zeros_like(n), where=length > 0)
+
+# Each writer formats the whole file in memory and writes it once
+
+def writeSTL(path, vertices, faces):
+    record = np.dtype([('normal', '<f4', 3), ('vertices', '<f4', (3, 3)), ('attr', '<u2')])
+    data = np.zeros(len(faces), dtype=record)
+    data['normal'] = faceNormals(vertices, faces)
+    data['vertices'] = vertices[faces]
+    header = b"Antenna Simulator radiation pattern".ljust(80, b" ")
+    with open(path, "wb") as f:
+        f.write(header + np.uint32(len(faces)).tobytes() + data.tobytes())
+
+def writePLY(path, vertices, faces):
+    header = ("ply\nformat binary_little_endian 1.0\n"
+              "element vertex %d\nproperty float x\nproperty float y\nproperty float z\n"
+              "element face %d\nproperty list uchar int vertex_indices\nend_header\n"
+              % (len(vertices), len(faces)))
+    face = np.dtype([('count', 'u1'), ('index', '<i4', 3)])
+    data = np.empty(len(faces), dtype=face)
+    data['count'] = 3
+    data['index'] = faces
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii") + vertices.astype('<f4').tobytes() + data.tobytes())
+
+def writeOBJ(path, vertices, faces):
+    # One format call per section instead of one per line, indices are 1-based
+    text = (("v %.7g %.7g %.7g\n" * len(vertices)) % tuple(vertices.ravel())
+            + ("f %d %d %d\n" * len(faces)) % tuple((faces + 1).ravel()))
+    with open(path, "w") as f:
+        f.write(text)
+
+MESH_WRITERS = {".stl": writeSTL, ".ply": writePLY, ".obj": writeOBJ}
+
+def exportMesh(path, rad3D, sphere):
+    # Format follows the file extension
+    ext = os.path.splitext(path)[1].lower()
+    if(ext not in MESH_WRITERS):
+        raise ValueError("Unknown mesh format: %s" % ext)
+    vertices, faces = surfaceMesh(rad3D, sphere)
+    MESH_WRITERS[ext](path, vertices, faces)
+    return vertices, faces
+
+### /MESH ###
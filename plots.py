@@ -10,9 +10,48 @@ import numpy as np
 from numpy import pi
 from matplotlib.figure import Figure
 import antennas as ant
+import patternio as pio
+from worker import PatternWorker
+from timing import TIMER
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import cm
 
+# Dipole length used for a length slider at 0, see GUI.upL
+MIN_LENGTH = 0.0001
+
+# Slider step and range per parameter in slider units (d_phi in degrees), as
+# in GUI.create_widgets. While the worker is idle, the states one step away
+# from the current one are computed so the next slider step finds its
+# pattern in the cache.
+PREFETCH_STEPS = {"d": (0.01, 0, 2), "len": (0.01, 0, 1.75),
+                  "d_phi": (10, -180, 180), "numEle": (1, 2, 20)}
+
+def sliderNeighbours(field, value, step, low, high):
+    # Parameter values one slider step either side of value, snapped to the
+    # slider grid and converted the way the setters do
+    if(field == "d_phi"):
+        value = np.degrees(value)
+    position = int(round((value - low) / step))
+    neighbours = []
+    for k in (position + 1, position - 1):
+        if(k < 0 or k > round((high - low) / step)):
+            continue
+        x = round(low + k * step, 6)
+        if(field == "d_phi"):
+            x = np.radians(int(x))
+        elif(field == "len"):
+            x = x if x != 0 else MIN_LENGTH
+        elif(field == "numEle"):
+            x = int(x)
+        neighbours.append(x)
+    return neighbours
+
+# Level of detail for the 3D view: while it is being rotated or zoomed the
+# surface is decimated to at most LOD_MESH cells a side, the full mesh comes
+# back once the view has been left alone for LOD_IDLE_MS
+LOD_MESH = 40
+LOD_IDLE_MS = 300
+
 ### Create Plot Class ###
 class Plots(Figure):
     def __init__(self, figsize=None, dpi=None):
@@ -45,113 +84,407 @@ class Plots(Figure):
         self.dx.set_title("Antenna Directivity (Linear)", pad=10)
 
         ### SET INITIAL ANTENNA PARAMETERS ###
-        self.theta2D = np.linspace(-pi, pi, 10000)
+        self.res2D = 10000
+        self.res3D = None
+        self.sampling3D = "grid"
+        self.adaptive2D = False
+        self.tolerance2D = 1e-3
+        self.theta2D = np.linspace(-pi, pi, self.res2D)
         self.numEle = 2
         self.simType = "Single Dipole"
         self.arrType = "NoDip"
         self.d_phi = float(0)
-        self.d = float(0.0000001)
-        self.len = float(0.0000001)
+        self.d = float(0)
+        self.len = float(MIN_LENGTH)
+        self.cutPhi = None
+        self.cut2D = None
         self.plot3D = False
+        self.timingText = None
+        self.holdUpdates = False
+        self.worker = None
+        self.lod3D = True
+        self.coarse3D = False
         self.antProf = ant.AntennaProfile(self)
+        # Off until attachCanvas hands over a canvas that can blit, so the
+        # figure saves and draws normally outside the GUI
+        self.blitting = False
+        self.backgrounds2D = None
         self.init_2Dplots()
         
 
     
     def init_2Dplots(self):
-        self.ax.plot(self.theta2D, self.antProf.eRad2D,'b', label="E-Plane")
-        self.bx.plot(self.theta2D, self.antProf.eRad2D,'b', label="E-Plane")
-        self.ax.plot(self.theta2D, self.antProf.hRad2D,'g', label="H-Plane")
-        self.bx.plot(self.theta2D, self.antProf.hRad2D,'g', label="H-Plane")
-        self.cx.plot(self.theta2D, self.antProf.DtPat,'b')
-        self.dx.plot(self.theta2D, self.antProf.DtPat,'b')
+        # The lines are created once and only get new data on updates, see
+        # update_2Dplot. The cut line stays hidden until a cut is requested.
+        prof = self.antProf
+        self.eLines = (self.ax.plot(prof.gamma, prof.eRad2D,'b', label="E-Plane")[0],
+                       self.bx.plot(prof.gamma, prof.eRad2D,'b', label="E-Plane")[0])
+        self.hLines = (self.ax.plot(prof.gamma, prof.hRad2D,'g', label="H-Plane")[0],
+                       self.bx.plot(prof.gamma, prof.hRad2D,'g', label="H-Plane")[0])
+        self.dLines = (self.cx.plot(prof.gamma, prof.DtPat,'b')[0],
+                       self.dx.plot(prof.gamma, prof.DtPat,'b')[0])
+        self.cutLines = (self.ax.plot([], [], 'r', visible=False)[0],
+                         self.bx.plot([], [], 'r', visible=False)[0])
+        self.static2DChanged = True
         self.ax.legend(loc='upper right')
-        self.cx.set_rmax(int(self.antProf.direc) + 1)
-        self.dx.set_ylim(0, int(self.antProf.direc) + 1)
+        self.direcBound = int(prof.direc) + 1
+        self.cx.set_rmax(self.direcBound)
+        self.dx.set_ylim(0, self.direcBound)
         self.bx.legend(loc='upper right')
-    
+        self.setBlitting(True)
+        # Orientation and legends are applied on the first update
+        self.layout2D = None
+
     def init_3Dplot(self):
 
-        self.theta3D = np.linspace(0.0000000000001, pi, 40 + self.numEle * 10)
-        self.phi3D = np.linspace(-pi, pi, 40 + self.numEle * 10)
-        self.THETA, self.PHI = np.meshgrid(self.theta3D, self.phi3D)
-        self.gamma3D = np.arccos(np.sin(self.PHI)*np.sin(self.THETA))
+        # The arrays can't change type while the 3D plot is open, so the mesh
+        # axis is picked once here
+        if(self.sampling3D == "equalArea"):
+            self.sphere = ant.equalAreaGrid(ant.equalAreaPoints(self.meshSize()))
+            self.theta3D, self.phi3D = self.sphere.THETA, self.sphere.PHI
+        else:
+            self.sphere = ant.sphereGrid(self.meshSize(), ant.sphereAxis(ant.AntennaParams.fromPlots(self)))
+            self.theta3D, self.phi3D = self.sphere.polar, self.sphere.azimuth
+        self.THETA, self.PHI = self.sphere.THETA, self.sphere.PHI
 
         self.antProf.init_3DPlot(self)
-        self.X = self.antProf.rad3D * np.sin(self.THETA) * np.cos(self.PHI)
-        self.Y = self.antProf.rad3D * np.sin(self.THETA) * np.sin(self.PHI)
-        self.Z = self.antProf.rad3D * np.cos(self.THETA)
-        self.ex.plot_surface(self.X, self.Y, self.Z, rstride=1, cstride=1, cmap=plt.get_cmap('jet'),
-        linewidth=0, antialiased=False, alpha=0.5)
+        self.X = self.antProf.rad3D * self.sphere.ux
+        self.Y = self.antProf.rad3D * self.sphere.uy
+        self.Z = self.antProf.rad3D * self.sphere.uz
+        if(self.sampling3D == "equalArea"):
+            self.surface = self.ex.plot_trisurf(self.X, self.Y, self.Z, triangles=self.sphere.triangles,
+            cmap=plt.get_cmap('jet'), linewidth=0, antialiased=False, alpha=0.5)
+        else:
+            self.surface = self.ex.plot_surface(self.X, self.Y, self.Z, rstride=1, cstride=1, cmap=plt.get_cmap('jet'),
+            linewidth=0, antialiased=False, alpha=0.5)
         self.ex.set_xlim(-1,1)
         self.ex.set_ylim(-1,1)
         self.ex.set_zlim(-1,1)
 
+        self.coarse3D = False
+        self.lodTimer = self.canvas.new_timer(interval=LOD_IDLE_MS)
+        self.lodTimer.single_shot = True
+        self.lodTimer.add_callback(self.refine3D)
+        self.lodCids = [self.canvas.mpl_connect(name, self.on3DInteraction)
+                        for name in ('motion_notify_event', 'scroll_event')]
+
+    def update_3Dplot(self):
+        # Reuses the surface from init_3Dplot, only its quads and colors are
+        # replaced so nothing piles up on the axes between updates
+        with TIMER.stage("artists3D"):
+            self.X = self.antProf.rad3D * self.sphere.ux
+            self.Y = self.antProf.rad3D * self.sphere.uy
+            self.Z = self.antProf.rad3D * self.sphere.uz
+            self.drawSurface()
+        self.updateTimingOverlay()
+
+    def drawSurface(self):
+        polys = self.surfacePolys()
+        self.surface.set_verts(polys)
+        # plot_surface and plot_trisurf color each polygon by its mean height
+        self.surface.set_array(polys[..., 2].mean(axis=1))
+        self.surface.autoscale()
+
+    def surfacePolys(self):
+        if(self.sampling3D != "equalArea"):
+            return self.surfaceQuads(self.lodStride() if self.coarse3D else 1)
+        if(self.coarse3D):
+            # Decimating a lattice doesn't leave a lattice, the coarse surface
+            # gets its own, cheap to evaluate at LOD_MESH size
+            sphere = ant.equalAreaGrid(ant.equalAreaPoints(LOD_MESH + 1))
+            rad3D = ant.pattern3D(ant.AntennaParams.fromPlots(self), sphere)
+            P = np.column_stack((rad3D * sphere.ux, rad3D * sphere.uy, rad3D * sphere.uz))
+        else:
+            sphere = self.sphere
+            P = np.column_stack((self.X, self.Y, self.Z))
+        return P[sphere.triangles]
+
+    def surfaceQuads(self, stride=1):
+        # Same quads as plot_surface with rstride=cstride=stride, row major with
+        # the corners going around each cell. Decimated meshes keep the last
+        # row and column so the surface still closes.
+        X, Y, Z = self.X, self.Y, self.Z
+        if stride > 1:
+            rows = np.unique(np.r_[0:X.shape[0]:stride, X.shape[0] - 1])
+            cols = np.unique(np.r_[0:X.shape[1]:stride, X.shape[1] - 1])
+            X, Y, Z = (A[np.ix_(rows, cols)] for A in (X, Y, Z))
+        P = np.stack((X, Y, Z), axis=-1)
+        quads = np.stack((P[:-1, :-1], P[:-1, 1:], P[1:, 1:], P[1:, :-1]), axis=2)
+        return quads.reshape(-1, 4, 3)
+
+    def lodStride(self):
+        return -(-(max(self.X.shape) - 1) // LOD_MESH)
+
+    def lodAvailable(self):
+        if(self.sampling3D == "equalArea"):
+            return self.sphere.shape[0] > ant.equalAreaPoints(LOD_MESH + 1)
+        return self.lodStride() > 1
+
+    def on3DInteraction(self, event):
+        # Mouse drags rotate the view, so plain moves are ignored
+        if(not self.lod3D or not self.plot3D or event.inaxes is not self.ex):
+            return
+        if(event.name == 'motion_notify_event' and event.button is None):
+            return
+        if(not self.coarse3D and self.lodAvailable()):
+            self.coarse3D = True
+            self.drawSurface()
+        self.lodTimer.stop()
+        self.lodTimer.start()
+
+    def refine3D(self):
+        if(self.plot3D and self.coarse3D):
+            self.coarse3D = False
+            self.drawSurface()
+            self.canvas.draw_idle()
+
+    def setLOD3D(self, lod):
+        self.lod3D = bool(lod)
+        if(not self.lod3D):
+            self.refine3D()
+
     def update_plots(self):
+        # With a worker the update is only submitted, showResult runs when
+        # the GUI polls it back
+        if(self.holdUpdates):
+            return
+        if(self.worker is not None):
+            self.worker.submit(self.updateJob())
+        else:
+            self.showResult(self.updateJob()())
+
+    def updateJob(self):
+        # The computation for the current state, as a callable that only
+        # touches the pattern engine so it can run on the worker thread
+        prof = self.antProf
+        params = ant.AntennaParams.fromPlots(self)
         if(self.plot3D):
-            self.antProf.init_3DPlot(self)
-            del self.ex.lines[0:len(self.ex.lines)]
-            self.X = self.antProf.rad3D * np.sin(self.THETA) * np.cos(self.PHI)
-            self.Y = self.antProf.rad3D * np.sin(self.THETA) * np.sin(self.PHI)
-            self.Z = self.antProf.rad3D * np.cos(self.THETA)
-            self.ex.plot_surface(self.X, self.Y, self.Z, rstride=1, cstride=1, cmap=plt.get_cmap('jet'),
-            linewidth=0, antialiased=False, alpha=0.5)
+            sphere = self.sphere
+            return lambda: ("3D", params, sphere, prof.compute3D(params, sphere), None)
+        settings = (self.adaptive2D, self.tolerance2D, self.theta2D)
+        cutPhi = self.cutPhi
+        def job():
+            # The cut goes with the result as (phi, cut) so the two match
+            gamma, pattern = prof.compute2D(params, *settings)
+            cut = None
+            if(cutPhi is not None):
+                cut = (cutPhi, prof.computeCut(params, gamma, phi=cutPhi))
+            return ("2D", params, None, (gamma, pattern), cut)
+        return job
+
+    def showResult(self, result):
+        kind, params, sphere, data, cut = result
+        if(kind == "3D"):
+            self.antProf.apply3D(params, sphere, data)
+            if(self.plot3D and sphere is self.sphere):
+                self.update_3Dplot()
         else:
-            self.antProf.update_2DPlot(self)
-            del self.ax.lines[0:len(self.ax.lines)]
-            del self.bx.lines[0:len(self.bx.lines)]
-            del self.cx.lines[0:len(self.cx.lines)]
-            del self.dx.lines[0:len(self.dx.lines)]
-            if(self.simType == "Single Dipole"):
-                self.ax.plot(self.theta2D, self.antProf.eRad2D,'b', label="E-Plane")
-                self.bx.plot(self.theta2D, self.antProf.eRad2D,'b', label="E-Plane")
-                self.ax.plot(self.theta2D, self.antProf.hRad2D,'g', label="H-Plane")
-                self.bx.plot(self.theta2D, self.antProf.hRad2D,'g', label="H-Plane")
-                self.cx.plot(self.theta2D, self.antProf.DtPat,'b')
-                self.dx.plot(self.theta2D, self.antProf.DtPat,'b')
-                self.ax.set_theta_direction(-1)
-                self.ax.set_theta_zero_location("N")
-                self.cx.set_theta_direction(-1)
-                self.cx.set_theta_zero_location("N")
-            elif(self.simType == "Antenna Array" and self.arrType == "NoDip"):  
-                self.ax.plot(self.theta2D, self.antProf.eRad2D,'b', label="Antenna Factor")
-                self.bx.plot(self.theta2D, self.antProf.eRad2D,'b', label="Antenna Factor")
-                self.cx.plot(self.theta2D, self.antProf.DtPat,'b')
-                self.dx.plot(self.theta2D, self.antProf.DtPat,'b')
-                self.ax.set_theta_direction(1)
-                self.ax.set_theta_zero_location("E")
-                self.cx.set_theta_direction(1)
-                self.cx.set_theta_zero_location("E")
-            elif(self.simType == "Antenna Array"):
-                self.ax.plot(self.antProf.gamma, self.antProf.eRad2D,'b', label="E-Plane")
-                self.bx.plot(self.antProf.gamma, self.antProf.eRad2D,'b', label="E-Plane")
-                self.ax.plot(self.antProf.gamma, self.antProf.hRad2D,'g', label="H-Plane")
-                self.bx.plot(self.antProf.gamma, self.antProf.hRad2D,'g', label="H-Plane")
-                self.cx.plot(self.antProf.gamma, self.antProf.DtPat,'b')
-                self.dx.plot(self.antProf.gamma, self.antProf.DtPat,'b')
-                self.ax.set_theta_direction(1)
-                self.ax.set_theta_zero_location("E")
-                self.cx.set_theta_direction(1)
-                self.cx.set_theta_zero_location("E")
-            self.ax.legend(loc='upper right')
-            self.cx.set_rmax(int(self.antProf.direc) + 1)
-            self.dx.set_ylim(0, int(self.antProf.direc) + 1)
-            self.bx.legend(loc='upper right')
-    
+            self.antProf.apply2D(params, *data)
+            self.cut2D = cut
+            self.update_2Dplot()
+        if(self.worker is not None):
+            self.worker.prefetch(self.neighbourJobs(params, sphere))
+
+    def neighbourJobs(self, params, sphere):
+        # Jobs for the states one slider step away that the configuration
+        # actually depends on, judged by whether the cache key changes. In 3D
+        # only the element count slider is enabled.
+        prof = self.antProf
+        key = ant.patternKey(params)
+        settings = (self.adaptive2D, self.tolerance2D, self.theta2D)
+        fields = ("numEle",) if sphere is not None else tuple(PREFETCH_STEPS)
+        jobs = []
+        for field in fields:
+            for value in sliderNeighbours(field, getattr(params, field), *PREFETCH_STEPS[field]):
+                neighbour = params._replace(**{field: value})
+                if(ant.patternKey(neighbour) == key):
+                    continue
+                if(sphere is not None):
+                    jobs.append(lambda n=neighbour: prof.compute3D(n, sphere, speculative=True))
+                else:
+                    jobs.append(lambda n=neighbour: prof.compute2D(n, *settings, speculative=True))
+        return [lambda job=job: self.mutedJob(job) for job in jobs]
+
+    def mutedJob(self, job):
+        # Prefetching stays out of the stage timings
+        with TIMER.muted():
+            return job()
+
+    def startWorker(self):
+        self.worker = PatternWorker()
+
+    def pollWorker(self):
+        # True when a result came back and was put on the figure
+        result = self.worker.poll()
+        if(result is None):
+            return False
+        self.showResult(result)
+        return True
+
+    def update_2Dplot(self):
+        with TIMER.stage("artists2D"):
+            prof = self.antProf
+            for line in self.eLines:
+                line.set_data(prof.gamma, prof.eRad2D)
+            for line in self.hLines:
+                line.set_data(prof.gamma, prof.hRad2D)
+            for line in self.dLines:
+                line.set_data(prof.gamma, prof.DtPat)
+            cutLabel = None
+            if(self.cut2D is not None):
+                # Shares the E/H-plane angle: phi turns the cut plane about the
+                # dipole axis, or about the array axis for arrays
+                cutPhi, self.cutRad2D = self.cut2D
+                cutLabel = "\u03c6 = %d\u00b0 Cut" % round(np.degrees(cutPhi))
+                for line in self.cutLines:
+                    line.set_data(prof.gamma, self.cutRad2D)
+            # Legends and orientation only change with the configuration type or
+            # the cut, limits only with the directivity bound
+            params = prof.params2D
+            layout = (params.simType, params.simType == "Antenna Array" and params.arrType == "NoDip", cutLabel)
+            if(layout != self.layout2D):
+                self.apply2DLayout(layout)
+                self.static2DChanged = True
+            direcBound = int(prof.direc) + 1
+            if(direcBound != self.direcBound):
+                self.direcBound = direcBound
+                self.cx.set_rmax(direcBound)
+                self.dx.set_ylim(0, direcBound)
+                self.static2DChanged = True
+        self.updateTimingOverlay()
+
+    def blitArtists(self):
+        # Everything that changes on a slider update, the legends last so they
+        # stay on top of the lines
+        legends = tuple(axis.get_legend() for axis in (self.ax, self.bx) if axis.get_legend() is not None)
+        overlay = (self.timingText,) if self.timingText is not None else ()
+        return self.eLines + self.hLines + self.dLines + self.cutLines + legends + overlay
+
+    def setBlitting(self, blitting):
+        # Animated artists are left out of full draws so the axes behind them
+        # can be saved, onDraw then puts them back on top. Never animated
+        # without a canvas that blits.
+        for artist in self.blitArtists():
+            artist.set_animated(blitting and self.blitting)
+
+    def attachCanvas(self, canvas):
+        # Called by the GUI with its canvas. Slider updates are blitted from
+        # then on if the canvas supports it.
+        if(not canvas.supports_blit):
+            return
+        self.blitting = True
+        self.setBlitting(not self.plot3D)
+        self.static2DChanged = True
+        canvas.mpl_connect('draw_event', self.onDraw)
+
+    def drawPatternLines(self, axis, renderer):
+        for artist in self.blitArtists():
+            if(artist.axes is axis and artist.get_visible()):
+                artist.draw(renderer)
+
+    def onDraw(self, event):
+        # Every full draw puts the animated lines back on top, and refreshes
+        # the saved 2D backgrounds when it was drawn on a canvas that blits.
+        # Saving to another format draws through a different canvas.
+        if(self.plot3D or not self.blitting):
+            return
+        axes2D = (self.ax, self.bx, self.cx, self.dx)
+        if(event.canvas.supports_blit):
+            self.backgrounds2D = [event.canvas.copy_from_bbox(axis.bbox) for axis in axes2D]
+            self.static2DChanged = False
+        for axis in axes2D:
+            self.drawPatternLines(axis, event.renderer)
+
+    def blit2D(self):
+        # Redraws only the pattern lines over the saved backgrounds. Returns
+        # False when something static changed and a full draw is needed.
+        if(not self.blitting or self.plot3D or self.static2DChanged or self.backgrounds2D is None):
+            return False
+        renderer = self.canvas.get_renderer()
+        for axis, background in zip((self.ax, self.bx, self.cx, self.dx), self.backgrounds2D):
+            self.canvas.restore_region(background)
+            self.drawPatternLines(axis, renderer)
+            self.canvas.blit(axis.bbox)
+        return True
+
+    def setTimingOverlay(self, show):
+        # Stage timings in the corner of the linear pattern plot, refreshed
+        # with every update
+        if(show and self.timingText is None):
+            self.timingText = self.bx.text(0.02, 0.97, "", transform=self.bx.transAxes, va='top',
+                                           family='monospace', fontsize=8)
+            self.setBlitting(not self.plot3D)
+            self.updateTimingOverlay()
+        elif(not show and self.timingText is not None):
+            self.timingText.remove()
+            self.timingText = None
+        self.static2DChanged = True
+
+    def updateTimingOverlay(self):
+        if(self.timingText is None):
+            return
+        summary = TIMER.summary()
+        rows = []
+        for stage in ("compute3D" if self.plot3D else "compute2D", "artists3D" if self.plot3D else "artists2D",
+                      "draw", "blit"):
+            if stage in summary:
+                rows.append("%-10s %7.1f ms  p90 %7.1f" % (stage, summary[stage]["last"], summary[stage]["p90"]))
+        self.timingText.set_text("\n".join(rows))
+
+    def dumpTimings(self, path):
+        TIMER.dumpJSON(path)
+
+    def apply2DLayout(self, layout):
+        self.layout2D = layout
+        simType, noDip, cutLabel = layout
+        for line in self.eLines:
+            line.set_label("Antenna Factor" if noDip else "E-Plane")
+        for line in self.hLines:
+            line.set_visible(not noDip)
+        for line in self.cutLines:
+            line.set_visible(cutLabel is not None)
+            line.set_label(cutLabel if cutLabel is not None else "_cut")
+        if(simType == "Single Dipole"):
+            direction, zero = -1, "N"
+        else:
+            direction, zero = 1, "E"
+        for axis in (self.ax, self.cx):
+            axis.set_theta_direction(direction)
+            axis.set_theta_zero_location(zero)
+        for axis, lines in ((self.ax, 0), (self.bx, 1)):
+            handles = [group[lines] for group in (self.eLines, self.hLines, self.cutLines)
+                       if group[lines].get_visible()]
+            axis.legend(handles=handles, loc='upper right')
+        self.setBlitting(not self.plot3D)
+
+    def applyChanges(self, changes):
+        # changes maps setter names to new values, they are all applied before
+        # a single update
+        self.holdUpdates = True
+        try:
+            for setter, value in changes.items():
+                getattr(self, setter)(value)
+        finally:
+            self.holdUpdates = False
+        self.update_plots()
+
     def setDPhi(self, newDPhi):
         self.d_phi = np.radians(int(newDPhi))
         self.update_plots()
     
     def setD(self, newD):
         self.d = float(newD)
-        if(self.d == 0):
-            self.d = 0.0001
         self.update_plots()
     
     def setL(self, newLen):
         self.len = float(newLen)
         self.update_plots()
     
+    def setCut(self, newCut):
+        # Azimuth of an extra pattern cut in degrees, None hides it
+        self.cutPhi = None if newCut is None else np.radians(float(newCut))
+        self.update_plots()
+
     def setSimType(self, newtype):
         self.simType = newtype
         self.update_plots()
@@ -160,17 +493,70 @@ class Plots(Figure):
         self.arrType = newtype
         self.update_plots()
     
+    def setRes2D(self, newRes):
+        self.res2D = int(newRes)
+        self.theta2D = np.linspace(-pi, pi, self.res2D)
+        self.update_plots()
+
+    def setRes3D(self, newRes):
+        # None restores the element count based mesh. Picked up the next time
+        # the 3D plot is opened.
+        self.res3D = newRes
+
+    def setSampling3D(self, sampling):
+        # "grid" for the theta/phi mesh, "equalArea" for a triangulated
+        # Fibonacci lattice with the same resolution and about 2/pi of the
+        # points. Picked up the next time the 3D plot is opened.
+        if sampling not in ("grid", "equalArea"):
+            raise ValueError("Unknown 3D sampling: %s" % sampling)
+        self.sampling3D = sampling
+
+    def setAdaptive(self, adaptive, tolerance=None):
+        # Adaptive cuts refine a coarse grid around lobes and nulls until the
+        # pattern is resolved to the tolerance, and ignore res2D
+        self.adaptive2D = bool(adaptive)
+        if tolerance is not None:
+            self.tolerance2D = float(tolerance)
+        self.update_plots()
+
+    def meshSize(self):
+        if self.res3D is None:
+            return 40 + self.numEle * 10
+        return int(self.res3D)
+
+    def exportPattern(self, path, raw=False):
+        # .npz archive, or a directory of memory-mappable arrays when raw
+        arrays, meta = pio.profileRecord(self)
+        if(raw):
+            pio.saveRaw(path, arrays, meta)
+        else:
+            pio.saveNpz(path, arrays, meta)
+
+    def exportMesh(self, path):
+        # STL, PLY or OBJ by extension. Uses the 3D field when it is current,
+        # otherwise evaluates one at the 3D plot's resolution.
+        params = ant.AntennaParams.fromPlots(self)
+        if(self.antProf.rad3DKey == ant.patternKey(params)):
+            return pio.exportMesh(path, self.antProf.rad3D, self.antProf.sphere3D)
+        sphere = ant.sphereGrid(self.meshSize(), ant.sphereAxis(params))
+        return pio.exportMesh(path, ant.pattern3D(params, sphere), sphere)
+
     def setNumEle(self, newNumEle):
         self.numEle = int(newNumEle)
         self.update_plots()
         
     def toggle3D(self):
         self.plot3D = not self.plot3D
+        if(self.worker is not None):
+            # Anything in flight was computed for the other view
+            self.worker.cancel()
         if(self.plot3D == True):
             self.ax.axis('off')
             self.bx.axis('off')
             self.cx.axis('off')
             self.dx.axis('off')
+            # Drawn in the normal order behind the 3D axes while they are up
+            self.setBlitting(False)
             self.ex = self.add_subplot(111, projection='3d')
             self.init_3Dplot()
         else:
@@ -178,6 +564,11 @@ class Plots(Figure):
             self.bx.axis('on')
             self.cx.axis('on')
             self.dx.axis('on')
+            self.setBlitting(True)
+            self.static2DChanged = True
+            self.lodTimer.stop()
+            for cid in self.lodCids:
+                self.canvas.mpl_disconnect(cid)
             self.ex.remove()
         return self.plot3D 
         
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling Module for Antenna Simulator
+
+Opt-in profiling of GUI interactions. Started with `--profile DIR` on the
+command line or the ANTENNA_PROFILE=DIR environment variable, every wrapped
+callback runs under cProfile and leaves a .prof file in DIR, and all of them
+go on one Chrome trace timeline (DIR/trace.json, open it in chrome://tracing
+or Perfetto). When profiling is off nothing is wrapped at all.
+"""
+
+import cProfile
+import itertools
+import json
+import os
+import threading
+import time
+
+PROFILE_ENV = "ANTENNA_PROFILE"
+PROFILE_FLAG = "--profile"
+
+def profileDirectory(argv):
+    # Output directory from the command line or the environment, else None
+    for i, arg in enumerate(argv):
+        if(arg.startswith(PROFILE_FLAG + "=")):
+            return arg.split("=", 1)[1]
+        if(arg == PROFILE_FLAG and i + 1 < len(argv)):
+            return argv[i + 1]
+    return os.environ.get(PROFILE_ENV) or None
+
+class InteractionProfiler():
+    # Trace events are appended as they happen in the JSON array format,
+    # which trace viewers accept without the closing bracket, so the trace
+    # survives the app being killed while frozen
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.start = time.perf_counter()
+        self.count = itertools.count()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.trace = open(os.path.join(directory, "trace.json"), "w")
+        self.trace.write("[\n")
+        self.trace.flush()
+
+    def wrap(self, name, callback):
+        # Only one cProfile can run per thread (per process from Python 3.12),
+        # a call that can't get one still gets its trace event
+        def profiled(*args, **kwargs):
+            profile = None
+            outer = not getattr(self.local, "active", False)
+            if(outer):
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    profile = None
+            self.local.active = True
+            begin = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                if(profile is not None):
+                    profile.disable()
+                if(outer):
+                    self.local.active = False
+                self.record(name, begin, end, profile)
+        return profiled
+
+    def instrument(self, obj, names):
+        # Shadows the named methods on this instance only, so it has to run
+        # before they are handed out as Tk commands
+        for name in names:
+            setattr(obj, name, self.wrap(name, getattr(obj, name)))
+
+    def instrumentJobs(self, plots):
+        # Pattern computations submitted to the worker get their own profiles
+        makeJob = plots.updateJob
+        plots.updateJob = lambda: self.wrap("compute", makeJob())
+
+    def record(self, name, begin, end, profile):
+        event = {"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                 "ts": (begin - self.start) * 1e6, "dur": (end - begin) * 1e6}
+        with self.lock:
+            index = next(self.count)
+            self.trace.write(json.dumps(event) + ",\n")
+            self.trace.flush()
+        if(profile is not None):
+            profile.dump_stats(os.path.join(self.directory, "%05d-%s.prof" % (index, name)))
+
+    def close(self):
+        with self.lock:
+            self.trace.write("{}]\n")
+            self.trace.close()
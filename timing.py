@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Timing Module for Antenna Simulator
+
+Keeps a rolling window of durations for each stage between a slider event
+and the redraw (pattern computation, artist updates, canvas draws) and
+reports percentiles over it, either on the figure overlay or as JSON. The
+GUI shows the overlay and dumps the JSON when started with `--timing PATH`
+or ANTENNA_TIMING=PATH.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+TIMING_ENV = "ANTENNA_TIMING"
+TIMING_FLAG = "--timing"
+
+def timingPath(argv):
+    # JSON dump path from the command line or the environment, else None
+    for i, arg in enumerate(argv):
+        if(arg.startswith(TIMING_FLAG + "=")):
+            return arg.split("=", 1)[1]
+        if(arg == TIMING_FLAG and i + 1 < len(argv)):
+            return argv[i + 1]
+    return os.environ.get(TIMING_ENV) or None
+
+class StageTimer():
+    # Stages are recorded from both the Tk loop and the worker thread
+    def __init__(self, window=256):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    @contextmanager
+    def muted(self):
+        # Nothing is recorded on this thread inside, for work that isn't on
+        # the path to a redraw such as prefetching
+        self.local.muted = True
+        try:
+            yield
+        finally:
+            self.local.muted = False
+
+    def record(self, name, seconds):
+        if(getattr(self.local, "muted", False)):
+            return
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(seconds * 1e3)
+
+    def summary(self):
+        # {stage: {"count", "last", "p50", "p90", "p99"}}, all times in ms
+        with self.lock:
+            samples = {name: np.array(s) for name, s in self.samples.items() if s}
+        summary = {}
+        for name, ms in samples.items():
+            stats = {"count": int(ms.size), "last": float(ms[-1])}
+            for q, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+                stats["p%d" % q] = float(value)
+            summary[name] = stats
+        return summary
+
+    def dumpJSON(self, path):
+        with open(path, "w") as f:
+            json.dump({"window": self.window, "stages": self.summary()}, f, indent=1)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+TIMER = StageTimer()
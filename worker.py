@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Worker Module for Antenna Simulator
+
+Runs pattern computations on a background thread so the Tk loop stays
+responsive while large meshes compute. Results are handed back through a
+queue that the GUI polls.
+"""
+
+import queue
+import threading
+from collections import deque
+
+class PatternWorker():
+    # Every request gets a generation number. A request still queued when a
+    # newer one arrives is skipped without running, and results are only
+    # handed out for the newest generation. A job already running can't be
+    # interrupted, its result is dropped instead.
+    # Speculative jobs only run while no request is waiting and only for the
+    # generation they were queued under. Their results are thrown away, they
+    # are there to fill caches.
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.speculative = deque()
+        self.thread = threading.Thread(target=self.run, name="PatternWorker", daemon=True)
+        self.thread.start()
+
+    def submit(self, job):
+        # job is a callable taking no arguments
+        self.generation += 1
+        self.requests.put((self.generation, job))
+        return self.generation
+
+    def cancel(self):
+        # Drops everything submitted so far
+        self.generation += 1
+
+    def prefetch(self, jobs):
+        # Replaces the speculative jobs queued so far
+        with self.lock:
+            self.speculative = deque((self.generation, job) for job in jobs)
+        # Wakes the thread up if it is waiting for requests
+        self.requests.put((None, None))
+
+    def nextJob(self):
+        try:
+            return self.requests.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            while self.speculative:
+                generation, job = self.speculative.popleft()
+                if(generation == self.generation):
+                    return None, job
+        return self.requests.get()
+
+    def run(self):
+        while True:
+            generation, job = self.nextJob()
+            if(job is None):
+                continue
+            if(generation is None):
+                # A failing guess only means a cache miss later
+                try:
+                    job()
+                except Exception:
+                    pass
+                continue
+            if(generation != self.generation):
+                continue
+            try:
+                result = job()
+            except Exception as error:
+                self.results.put((generation, error, True))
+            else:
+                self.results.put((generation, result, False))
+
+    def poll(self):
+        # Result of the newest request if it has finished, else None. Errors
+        # raised by the job are raised again here, on the polling thread.
+        latest = None
+        while True:
+            try:
+                generation, result, failed = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if(generation == self.generation):
+                latest = (result, failed)
+        if(latest is None):
+            return None
+        result, failed = latest
+        if(failed):
+            raise result
+        return result